@@ -14,8 +14,9 @@
 
 from __future__ import annotations
 
+import concurrent.futures
 import contextlib
-import errno
+import importlib.util
 import os
 import shutil
 import sys
@@ -27,10 +28,17 @@ from urllib.parse import urlparse
 from typing_extensions import TypeAlias
 
 import paddle
-from paddle.utils.download import _download, get_path_from_url
+from paddle.utils.download import (
+    ETAG_SUFFIX,
+    _download,
+    _read_etag,
+    _write_etag,
+    get_path_from_url,
+)
 
 if TYPE_CHECKING:
     import builtins
+    from types import ModuleType
     from typing import Any
 
 __all__ = []
@@ -41,6 +49,21 @@ DEFAULT_CACHE_DIR: str = '~/.cache'
 VAR_DEPENDENCY: str = 'dependencies'
 MODULE_HUBCONF: str = 'hubconf.py'
 HUB_DIR: str = os.path.expanduser(os.path.join('~', '.cache', 'paddle', 'hub'))
+_COPY_BUFSIZE: int = 1 << 20
+_MAX_EXTRACT_WORKERS: int = 16
+_WRITE_FLAGS: int = (
+    os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+)
+
+_ARCHIVE_URL_TEMPLATE: dict[str, str] = {
+    'github': 'https://github.com/{owner}/{name}/archive/{branch}.zip',
+    'gitee': 'https://gitee.com/{owner}/{name}/repository/archive/{branch}.zip',
+}
+_DEFAULT_BRANCH: dict[str, str] = {'github': 'main', 'gitee': 'master'}
+
+# Imported hubconf modules with the (mtime, size, inode) of their file,
+# keyed by the real path of their repo dir
+_HUBCONF_CACHE: dict[str, tuple[tuple[int, int, int], ModuleType]] = {}
 
 
 def _remove_if_exists(path):
@@ -52,56 +75,180 @@ def _remove_if_exists(path):
 
 
 def _import_module(name, repo_dir):
+    # Load the file directly instead of going through the finders, under
+    # a name unique to the repo so a user's own `hubconf` module is never
+    # shadowed.
+    module_file = os.path.join(repo_dir, name + '.py')
+    if not os.path.isfile(module_file):
+        raise RuntimeError(
+            'Please make sure config exists or repo error messages above fixed when importing'
+        )
+
+    # Local repos may be edited between calls, only reuse the cached
+    # module if the file has not been modified since it was imported.
+    # The mtime alone misses edits within one tick of coarse timestamps,
+    # so the size and inode are compared as well.
+    cache_key = os.path.realpath(repo_dir)
+    st = os.stat(module_file)
+    file_id = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _HUBCONF_CACHE.get(cache_key)
+    if cached is not None and cached[0] == file_id:
+        return cached[1]
+
+    module_name = f'{name}_{abs(hash(cache_key)):x}'
+    spec = importlib.util.spec_from_file_location(module_name, module_file)
+    hub_module = importlib.util.module_from_spec(spec)
+
+    # Like a regular import, keep the module in sys.modules, which e.g.
+    # dataclasses, pickle and typing.get_type_hints rely on.
+    sys.modules[module_name] = hub_module
+    # hubconf may import modules next to it in the repo
     sys.path.insert(0, repo_dir)
     try:
-        hub_module = __import__(name)
-        sys.modules.pop(name)
+        spec.loader.exec_module(hub_module)
     except ImportError:
-        sys.path.remove(repo_dir)
+        sys.modules.pop(module_name, None)
         raise RuntimeError(
             'Please make sure config exists or repo error messages above fixed when importing'
         )
+    except BaseException:
+        sys.modules.pop(module_name, None)
+        raise
+    finally:
+        sys.path.remove(repo_dir)
 
-    sys.path.remove(repo_dir)
-
+    _HUBCONF_CACHE[cache_key] = (file_id, hub_module)
     return hub_module
 
 
-def _git_archive_link(repo_owner, repo_name, branch, source):
-    if source == 'github':
-        return (
-            f'https://github.com/{repo_owner}/{repo_name}/archive/{branch}.zip'
+def _build_archive_url(repo, source):
+    # repo is "repo_owner/repo_name[:branch]"
+    repo_info, _, branch = repo.partition(':')
+    repo_owner, _, repo_name = repo_info.partition('/')
+    if not repo_owner or not repo_name or '/' in repo_name or ':' in branch:
+        raise ValueError(
+            f'Invalid repo: "{repo}", it should be "repo_owner/repo_name[:tag_name]"'
         )
-    elif source == 'gitee':
-        return f'https://gitee.com/{repo_owner}/{repo_name}/repository/archive/{branch}.zip'
+    branch = branch or _DEFAULT_BRANCH[source]
+    url = _ARCHIVE_URL_TEMPLATE[source].format(
+        owner=repo_owner, name=repo_name, branch=branch
+    )
+    return repo_owner, repo_name, branch, url
 
 
-def _parse_repo_info(repo, source):
-    branch = 'main' if source == 'github' else 'master'
-    if ':' in repo:
-        repo_info, branch = repo.split(':')
-    else:
-        repo_info = repo
-    repo_owner, repo_name = repo_info.split('/')
-    return repo_owner, repo_name, branch
+def _make_dirs(dirname):
+    os.makedirs(dirname, exist_ok=True)
 
 
-def _make_dirs(dirname):
+def _member_path(root, name):
+    # Resolve an archive member name under root, refusing to escape it
+    name = os.path.normpath(name)
+    if os.path.isabs(name) or name.split(os.sep)[0] == os.pardir:
+        raise RuntimeError(f'Invalid member {name} in zipfile')
+    return os.path.normpath(os.path.join(root, name))
+
+
+def _preallocate(fd, size):
+    # The member size is known upfront, reserve the blocks in one go
+    # instead of growing the file on every write. Only worth it for
+    # members that are written in several chunks.
+    if size <= _COPY_BUFSIZE:
+        return
     try:
-        from pathlib import Path
-    except ImportError:
-        from pathlib2 import Path
-    Path(dirname).mkdir(exist_ok=True)
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+    except OSError:
+        # Not supported by every filesystem, it's only an optimization
+        pass
+
+
+def _write_file(target, data):
+    fd = os.open(target, _WRITE_FLAGS, 0o666)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
+
+
+def _extract_member(zf, zi, target):
+    if zi.file_size <= _COPY_BUFSIZE:
+        # Small members are decompressed in memory and written with a
+        # single write() on a raw fd, which saves the extra syscalls of
+        # setting up a buffered file object.
+        _write_file(target, zf.read(zi))
+        return
+
+    with zf.open(zi) as src, open(target, 'wb', buffering=_COPY_BUFSIZE) as dst:
+        _preallocate(dst.fileno(), zi.file_size)
+        shutil.copyfileobj(src, dst, _COPY_BUFSIZE)
+
+
+def _extract_members(filename, members):
+    # ZipFile objects can not be shared between threads, each worker
+    # opens the archive once and extracts its own share of members.
+    with zipfile.ZipFile(filename) as zf:
+        for zi, target in members:
+            _extract_member(zf, zi, target)
+
+
+def _extract_repo(cached_file, repo_dir):
+    with zipfile.ZipFile(cached_file) as cached_zipfile:
+        members = cached_zipfile.infolist()
+
+    # Github/Gitee archives wrap everything in a single base folder,
+    # strip it so that entries are written to repo_dir in one pass.
+    extracted_repo_name = members[0].filename.split('/')[0] + '/'
+    dirs = {repo_dir}
+    files = []
+    for zi in members:
+        name = zi.filename
+        if name.startswith(extracted_repo_name):
+            name = name[len(extracted_repo_name) :]
+        target = _member_path(repo_dir, name)
+        if target == os.path.normpath(repo_dir):
+            continue
+        if zi.is_dir():
+            dirs.add(target)
+        else:
+            dirs.add(os.path.dirname(target))
+            files.append((zi, target))
 
+    # Create all directories up front so that workers never race on them
+    for dirname in sorted(dirs):
+        os.makedirs(dirname, exist_ok=True)
 
-def _get_cache_or_reload(repo, force_reload, verbose=True, source='github'):
+    num_workers = min(
+        _MAX_EXTRACT_WORKERS, (os.cpu_count() or 1) * 2, len(files)
+    )
+    if num_workers <= 1:
+        _extract_members(cached_file, files)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+        futures = [
+            executor.submit(
+                _extract_members, cached_file, files[i::num_workers]
+            )
+            for i in range(num_workers)
+        ]
+        for future in futures:
+            future.result()
+
+
+def _get_cache_or_reload(
+    repo, force_reload, verbose=True, source='github', check_fresh=False
+):
     # Setup hub_dir to save downloaded files
     hub_dir = HUB_DIR
 
     _make_dirs(hub_dir)
 
     # Parse github/gitee repo information
-    repo_owner, repo_name, branch = _parse_repo_info(repo, source)
+    repo_owner, repo_name, branch, url = _build_archive_url(repo, source)
     # Github allows branch name with slash '/',
     # this causes confusion with path on both Linux and Windows.
     # Backslash is not allowed in Github branch name so no need to
@@ -115,36 +262,70 @@ def _get_cache_or_reload(repo, force_reload, verbose=True, source='github'):
         hub_dir, '_'.join([repo_owner, repo_name, normalized_br])
     )
 
+    # The archive is read once and deleted, so open it where it was
+    # downloaded instead of moving it to another name first.
+    cached_file = os.path.join(hub_dir, os.path.basename(urlparse(url).path))
+
     use_cache = (not force_reload) and os.path.exists(repo_dir)
 
-    if use_cache:
+    if use_cache and not check_fresh:
         if verbose:
             sys.stderr.write(f'Using cache found in {repo_dir}\n')
-    else:
-        cached_file = os.path.join(hub_dir, normalized_br + '.zip')
-        _remove_if_exists(cached_file)
-
-        url = _git_archive_link(repo_owner, repo_name, branch, source=source)
+        return repo_dir
 
-        fpath = get_path_from_url(
+    # With check_fresh, a single conditional GET both validates the cache
+    # and downloads the new archive if the branch has changed.
+    etag = _read_etag(repo_dir) if use_cache else None
+    _remove_if_exists(cached_file)
+    _remove_if_exists(cached_file + ETAG_SUFFIX)
+    try:
+        cached_file = get_path_from_url(
             url,
             hub_dir,
             check_exist=not force_reload,
             decompress=False,
+            conditional=check_fresh,
+            etag=etag,
         )
-        shutil.move(fpath, cached_file)
-
-        with zipfile.ZipFile(cached_file) as cached_zipfile:
-            extracted_repo_name = cached_zipfile.infolist()[0].filename
-            extracted_repo = os.path.join(hub_dir, extracted_repo_name)
-            _remove_if_exists(extracted_repo)
-            # Unzip the code and rename the base folder
-            cached_zipfile.extractall(hub_dir)
-
+    except RuntimeError:
+        if not use_cache:
+            raise
+        warnings.warn(
+            f'Failed to check whether {repo} has changed, '
+            f'using cache found in {repo_dir}'
+        )
+        return repo_dir
+
+    if check_fresh:
+        etag = _read_etag(cached_file)
+        _remove_if_exists(cached_file + ETAG_SUFFIX)
+        if not os.path.exists(cached_file):
+            if verbose:
+                sys.stderr.write(f'Using cache found in {repo_dir}\n')
+            return repo_dir
+
+    # Unzip the code into a temp dir next to repo_dir and only move it in
+    # place once extraction has succeeded, so that a failure never leaves
+    # a broken repo behind to be picked up as cache.
+    tmp_repo_dir = repo_dir + '_tmp'
+    _remove_if_exists(tmp_repo_dir)
+    try:
+        _extract_repo(cached_file, tmp_repo_dir)
+    except BaseException:
+        _remove_if_exists(tmp_repo_dir)
+        raise
+    finally:
         _remove_if_exists(cached_file)
-        _remove_if_exists(repo_dir)
-        # Rename the repo
-        shutil.move(extracted_repo, repo_dir)
+
+    # os.replace can not overwrite a non-empty directory
+    _remove_if_exists(repo_dir + ETAG_SUFFIX)
+    _remove_if_exists(repo_dir)
+    _HUBCONF_CACHE.pop(os.path.realpath(repo_dir), None)
+    os.replace(tmp_repo_dir, repo_dir)
+    # The ETag is written once the repo is in place, a missing one only
+    # costs a full download on the next check.
+    if etag:
+        _write_etag(repo_dir, etag)
 
     return repo_dir
 
@@ -165,10 +346,10 @@ def _load_entry_from_hubconf(m, name):
 
 
 def _check_module_exists(name):
+    # find_spec only locates the module, without executing it
     try:
-        __import__(name)
-        return True
-    except ImportError:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
         return False
 
 
@@ -189,6 +370,7 @@ def list(
     repo_dir: str,
     source: _Source = 'github',
     force_reload: bool = False,
+    check_fresh: bool = False,
 ) -> builtins.list[str]:
     r"""
     List all entrypoints available in `github` hubconf.
@@ -202,6 +384,7 @@ def list(
 
         source (str): `github` | `gitee` | `local`. Default is `github`.
         force_reload (bool, optional): Whether to discard the existing cache and force a fresh download. Default is `False`.
+        check_fresh (bool, optional): Whether to revalidate the cached repo with a conditional request, and only download it again if it has changed. This needs network access, if the request fails the cached repo is used with a warning. Default is `False`.
 
     Returns:
         entrypoints: A list of available entrypoint names.
@@ -221,7 +404,11 @@ def list(
 
     if source in ('github', 'gitee'):
         repo_dir = _get_cache_or_reload(
-            repo_dir, force_reload, True, source=source
+            repo_dir,
+            force_reload,
+            True,
+            source=source,
+            check_fresh=check_fresh,
         )
 
     hub_module = _import_module(MODULE_HUBCONF.split('.')[0], repo_dir)
@@ -240,6 +427,7 @@ def help(
     model,
     source: _Source = 'github',
     force_reload: bool = False,
+    check_fresh: bool = False,
 ) -> str:
     """
     Show help information of model
@@ -254,6 +442,7 @@ def help(
         model (str): Model name.
         source (str): `github` | `gitee` | `local`. Default is `github`.
         force_reload (bool, optional): Default is `False`.
+        check_fresh (bool, optional): Whether to revalidate the cached repo with a conditional request, and only download it again if it has changed. This needs network access, if the request fails the cached repo is used with a warning. Default is `False`.
 
     Returns:
         docs
@@ -273,7 +462,11 @@ def help(
 
     if source in ('github', 'gitee'):
         repo_dir = _get_cache_or_reload(
-            repo_dir, force_reload, True, source=source
+            repo_dir,
+            force_reload,
+            True,
+            source=source,
+            check_fresh=check_fresh,
         )
 
     hub_module = _import_module(MODULE_HUBCONF.split('.')[0], repo_dir)
@@ -288,6 +481,7 @@ def load(
     model: str,
     source: _Source = 'github',
     force_reload: bool = False,
+    check_fresh: bool = False,
     **kwargs: Any,
 ) -> paddle.nn.Layer:
     """
@@ -303,6 +497,7 @@ def load(
         model (str): Model name.
         source (str): `github` | `gitee` | `local`. Default is `github`.
         force_reload (bool, optional): Default is `False`.
+        check_fresh (bool, optional): Whether to revalidate the cached repo with a conditional request, and only download it again if it has changed. This needs network access, if the request fails the cached repo is used with a warning. Default is `False`.
         **kwargs: Parameters using for model.
 
     Returns:
@@ -322,7 +517,11 @@ def load(
 
     if source in ('github', 'gitee'):
         repo_dir = _get_cache_or_reload(
-            repo_dir, force_reload, True, source=source
+            repo_dir,
+            force_reload,
+            True,
+            source=source,
+            check_fresh=check_fresh,
         )
 
     hub_module = _import_module(MODULE_HUBCONF.split('.')[0], repo_dir)
@@ -367,13 +566,7 @@ def load_state_dict_from_url(
         hub_dir = get_dir()
         model_dir = os.path.join(hub_dir, 'checkpoints')
 
-    try:
-        os.makedirs(model_dir)
-    except OSError as e:
-        if e.errno == errno.EEXIST:
-            pass
-        else:
-            raise
+    os.makedirs(model_dir, exist_ok=True)
     parts = urlparse(url)
     filename = os.path.basename(parts.path)
     if file_name is not None:
@@ -384,7 +577,7 @@ def load_state_dict_from_url(
         hash_prefix = None
         if check_hash:
             hash_prefix = check_hash
-        _download(url, model_dir, hash_prefix)
+        _download(url, model_dir, hash_prefix, fname=filename, resume=True)
 
     if map_location:
         assert map_location in ["cpu", "gpu", "xpu", "npu", "numpy", "np"]
@@ -402,10 +595,13 @@ def load_state_dict_from_url(
 
 
 def _is_legacy_zip_format(filename):
-    if zipfile.is_zipfile(filename):
-        infolist = zipfile.ZipFile(filename).infolist()
-        return len(infolist) == 1 and not infolist[0].is_dir()
-    return False
+    # Open the archive only once, instead of is_zipfile and then ZipFile
+    try:
+        with zipfile.ZipFile(filename) as f:
+            infolist = f.infolist()
+            return len(infolist) == 1 and not infolist[0].is_dir()
+    except zipfile.BadZipFile:
+        return False
 
 
 def _legacy_zip_load(filename, model_dir, map_location=None):
@@ -415,9 +611,9 @@ def _legacy_zip_load(filename, model_dir, map_location=None):
             raise RuntimeError(
                 'Only one file(not dir) is allowed in the zipfile'
             )
-        f.extractall(model_dir)
-        extracted_name = members[0].filename
-        extracted_file = os.path.join(model_dir, extracted_name)
+        extracted_file = _member_path(model_dir, members[0].filename)
+        os.makedirs(os.path.dirname(extracted_file), exist_ok=True)
+        _extract_member(f, members[0], extracted_file)
     if map_location:
         if map_location in ["numpy", "np"]:
             return paddle.load(extracted_file, return_numpy=True)
@@ -14,6 +14,7 @@
 
 from __future__ import annotations
 
+import errno
 import hashlib
 import os
 import os.path as osp
@@ -59,6 +60,7 @@ __all__ = ['get_weights_path_from_url']
 WEIGHTS_HOME = osp.expanduser("~/.cache/paddle/hapi/weights")
 
 DOWNLOAD_RETRY_LIMIT = 3
+ETAG_SUFFIX = '.etag'
 
 
 def is_url(path: str) -> bool:
@@ -123,6 +125,9 @@ def get_path_from_url(
     check_exist: bool = True,
     decompress: bool = True,
     method: Literal['wget', 'get'] = 'get',
+    headers: dict[str, str] | None = None,
+    conditional: bool = False,
+    etag: str | None = None,
 ) -> str:
     """Download from given url to root_dir.
     if file or directory specified by url is exists under
@@ -136,6 +141,12 @@ def get_path_from_url(
         md5sum (str|None, optional): md5 sum of download package
         decompress (bool, optional): decompress zip or tar file. Default is `True`
         method (str, optional): which download method to use. Support `wget` and `get`. Default is `get`.
+        headers (dict|None, optional): extra request headers. Default is None.
+        conditional (bool, optional): whether to download conditionally. If True, the ETag of the response
+            is saved to the returned path + `.etag`, and the returned path does not exist if the server
+            answers 304 Not Modified. Default is False.
+        etag (str|None, optional): ETag of the copy the caller already has, sent as `If-None-Match` when
+            `conditional` is True. Default is None.
 
     Returns:
         str: a local path to save downloaded models & weights & datasets.
@@ -154,46 +165,126 @@ def get_path_from_url(
         logger.info(f"Found {fullpath}")
     else:
         if ParallelEnv().current_endpoint in unique_endpoints:
-            fullpath = _download(url, root_dir, md5sum, method=method)
+            fullpath = _download(
+                url,
+                root_dir,
+                md5sum,
+                method=method,
+                headers=headers,
+                conditional=conditional,
+                etag=etag,
+            )
         else:
-            while not os.path.exists(fullpath):
+            # The ETag file is written last, and also for 304 responses
+            wait_path = fullpath + ETAG_SUFFIX if conditional else fullpath
+            while not os.path.exists(wait_path):
                 time.sleep(1)
 
     if ParallelEnv().current_endpoint in unique_endpoints:
-        if decompress and (
-            tarfile.is_tarfile(fullpath) or zipfile.is_zipfile(fullpath)
+        if (
+            decompress
+            and osp.exists(fullpath)
+            and (tarfile.is_tarfile(fullpath) or zipfile.is_zipfile(fullpath))
         ):
             fullpath = _decompress(fullpath)
 
     return fullpath
 
 
-def _get_download(url, fullname):
+def _fast_rename(src, dst):
+    # os.replace is a single rename syscall and overwrites dst atomically,
+    # only fall back to shutil.move when src and dst are on different devices.
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
+
+
+def _write_etag(fullname, etag):
+    with open(fullname + ETAG_SUFFIX, 'w') as f:
+        f.write(etag or '')
+
+
+def _read_etag(fullname):
+    if not osp.exists(fullname + ETAG_SUFFIX):
+        return None
+    with open(fullname + ETAG_SUFFIX) as f:
+        return f.read().strip()
+
+
+def _get_download(
+    url, fullname, headers=None, resume=False, conditional=False, etag=None
+):
     # using requests.get method
     fname = osp.basename(fullname)
+    tmp_fullname = fullname + "_tmp"
+    req_headers = dict(headers or {})
+    if conditional and etag:
+        req_headers['If-None-Match'] = etag
+    size = 0
+    if resume:
+        # The ETag of an unfinished download is kept next to its _tmp file.
+        # Resume it with a Range request guarded by If-Range, so the server
+        # sends the whole file again if it has changed in the meantime.
+        tmp_etag = _read_etag(tmp_fullname)
+        if tmp_etag and osp.exists(tmp_fullname):
+            size = osp.getsize(tmp_fullname)
+        if size:
+            req_headers['Range'] = f'bytes={size}-'
+            req_headers['If-Range'] = tmp_etag
     try:
         with httpx.stream(
-            "GET", url, timeout=None, follow_redirects=True
+            "GET", url, headers=req_headers, timeout=None, follow_redirects=True
         ) as req:
-            if req.status_code != 200:
+            if req.status_code == 304 and conditional:
+                # Not modified, keep what the caller already has
+                _write_etag(fullname, req.headers.get('etag') or etag)
+                return fullname
+
+            if req.status_code == 206 and size:
+                content_range = req.headers.get('content-range', '')
+                if not content_range.startswith(f'bytes {size}-'):
+                    # Start over on the next retry
+                    os.remove(tmp_fullname)
+                    raise RuntimeError(
+                        f"Unexpected Content-Range {content_range} when "
+                        f"resuming {url}"
+                    )
+                mode = 'ab'
+            elif req.status_code == 200:
+                if resume:
+                    _write_etag(tmp_fullname, req.headers.get('etag'))
+                mode = 'wb'
+            elif req.status_code == 416 and size:
+                # Nothing left after size, the _tmp file is already complete
+                mode = None
+            else:
                 raise RuntimeError(
                     f"Downloading from {url} failed with code "
                     f"{req.status_code}!"
                 )
 
-            tmp_fullname = fullname + "_tmp"
             total_size = req.headers.get('content-length')
-            with open(tmp_fullname, 'wb') as f:
-                if total_size:
-                    with tqdm(total=(int(total_size) + 1023) // 1024) as pbar:
+            if mode is not None:
+                with open(tmp_fullname, mode) as f:
+                    if total_size:
+                        with tqdm(
+                            total=(int(total_size) + 1023) // 1024
+                        ) as pbar:
+                            for chunk in req.iter_bytes(chunk_size=1024):
+                                f.write(chunk)
+                                pbar.update(1)
+                    else:
                         for chunk in req.iter_bytes(chunk_size=1024):
-                            f.write(chunk)
-                            pbar.update(1)
-                else:
-                    for chunk in req.iter_bytes(chunk_size=1024):
-                        if chunk:
-                            f.write(chunk)
-            shutil.move(tmp_fullname, fullname)
+                            if chunk:
+                                f.write(chunk)
+            _fast_rename(tmp_fullname, fullname)
+            if resume and osp.exists(tmp_fullname + ETAG_SUFFIX):
+                os.remove(tmp_fullname + ETAG_SUFFIX)
+            if conditional:
+                _write_etag(fullname, req.headers.get('etag'))
             return fullname
 
     except Exception as e:  # requests.exceptions.ConnectionError
@@ -204,7 +295,17 @@ def _get_download(url, fullname):
 _download_methods = {'get': _get_download}
 
 
-def _download(url, path, md5sum=None, method='get'):
+def _download(
+    url,
+    path,
+    md5sum=None,
+    method='get',
+    headers=None,
+    fname=None,
+    resume=False,
+    conditional=False,
+    etag=None,
+):
     """
     Download from url, save to path.
 
@@ -212,6 +313,11 @@ def _download(url, path, md5sum=None, method='get'):
     path (str): download to given path
     md5sum (str): md5 sum of download package
     method (str): which download method to use. Support `wget` and `get`. Default is `get`.
+    headers (dict|None): extra request headers, see `get_path_from_url`.
+    fname (str|None): file name to save as. Default is the last part of url.
+    resume (bool): whether to resume an unfinished previous download. Default is False.
+    conditional (bool): whether to download conditionally, see `get_path_from_url`.
+    etag (str|None): ETag sent as `If-None-Match`, see `get_path_from_url`.
 
     """
     assert method in _download_methods, f'make sure `{method}` implemented'
@@ -219,12 +325,22 @@ def _download(url, path, md5sum=None, method='get'):
     if not osp.exists(path):
         os.makedirs(path)
 
-    fname = osp.split(url)[-1]
+    fname = fname or osp.split(url)[-1]
     fullname = osp.join(path, fname)
     retry_cnt = 0
+    if conditional and osp.exists(fullname + ETAG_SUFFIX):
+        os.remove(fullname + ETAG_SUFFIX)
 
     logger.info(f"Downloading {fname} from {url}")
     while not (osp.exists(fullname) and _md5check(fullname, md5sum)):
+        if (
+            conditional
+            and not osp.exists(fullname)
+            and osp.exists(fullname + ETAG_SUFFIX)
+        ):
+            logger.info(f"{fname} from {url} is not modified")
+            break
+
         logger.info(f"md5check {fullname} and {md5sum}")
         if retry_cnt < DOWNLOAD_RETRY_LIMIT:
             retry_cnt += 1
@@ -233,7 +349,14 @@ def _download(url, path, md5sum=None, method='get'):
                 f"Download from {url} failed. " "Retry limit reached"
             )
 
-        if not _download_methods[method](url, fullname):
+        if not _download_methods[method](
+            url,
+            fullname,
+            headers=headers,
+            resume=resume,
+            conditional=conditional,
+            etag=etag,
+        ):
             time.sleep(1)
             continue
 
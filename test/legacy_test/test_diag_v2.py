@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import unittest
 
 import numpy as np
@@ -21,6 +22,19 @@ import paddle
 from paddle import base, static
 from paddle.base import core
 
+_RNG = np.random.default_rng(0)
+
+
+def _diag_with_padding(v, offset, padding_value):
+    # Same as np.diag(v, offset), but with padding_value off the diagonal
+    n = v.size + abs(offset)
+    out = np.full(
+        (n, n), padding_value, dtype=np.result_type(v.dtype, padding_value)
+    )
+    k = np.arange(v.size)
+    out[k + max(-offset, 0), k + max(offset, 0)] = v
+    return out
+
 
 class TestDiagV2Op(OpTest):
     def setUp(self):
@@ -42,7 +56,7 @@ class TestDiagV2Op(OpTest):
         self.padding_value = 0.0
 
     def init_input_output(self):
-        self.x = np.random.rand(10, 10).astype(self.dtype)
+        self.x = _RNG.random((10, 10)).astype(self.dtype)
         self.out = np.diag(self.x, self.offset)
 
     def set_input_output(self):
@@ -83,7 +97,7 @@ class TestDiagV2OpCase2(TestDiagV2Op):
 
 class TestDiagV2OpCase3(TestDiagV2Op):
     def init_input_output(self):
-        self.x = np.random.randint(-10, 10, size=(10, 10)).astype(self.dtype)
+        self.x = _RNG.integers(-10, 10, size=(10, 10)).astype(self.dtype)
         self.out = np.diag(self.x, self.offset)
 
 
@@ -96,29 +110,28 @@ class TestDiagV2OpCase4(TestDiagV2Op):
         self.padding_value = 2
 
     def init_input_output(self):
-        self.x = np.random.rand(100).astype(self.dtype)
-        n = self.x.size
-        self.out = (
-            self.padding_value * np.ones((n, n))
-            + np.diag(self.x, self.offset)
-            - np.diag(self.padding_value * np.ones(n))
-        )
+        self.x = _RNG.random(100, dtype=self.dtype)
+        self.out = _diag_with_padding(self.x, self.offset, self.padding_value)
 
 
 class TestDiagV2Error(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        paddle.enable_static()
+        cls.main = static.Program()
+        cls.startup = static.Program()
 
     def test_errors(self):
         paddle.enable_static()
-        main = static.Program()
-        startup = static.Program()
-        with static.program_guard(main, startup):
 
-            def test_diag_v2_type():
-                x = [1, 2, 3]
-                output = paddle.diag(x)
+        # The input type is checked before any op is added to a program
+        def test_diag_v2_type():
+            x = [1, 2, 3]
+            output = paddle.diag(x)
 
-            self.assertRaises(TypeError, test_diag_v2_type)
+        self.assertRaises(TypeError, test_diag_v2_type)
 
+        with static.program_guard(self.main, self.startup):
             x = paddle.static.data('data', [3, 3])
             self.assertRaises(TypeError, paddle.diag, x, offset=2.5)
 
@@ -129,185 +142,191 @@ class TestDiagV2Error(unittest.TestCase):
 
 
 class TestDiagV2API(unittest.TestCase):
-    def setUp(self):
-        self.input_np = np.random.random(size=(10, 10)).astype(np.float32)
-        self.expected0 = np.diag(self.input_np)
-        self.expected1 = np.diag(self.input_np, k=1)
-        self.expected2 = np.diag(self.input_np, k=-1)
-
-        self.input_np2 = np.random.rand(100)
-        self.offset = 0
-        self.padding_value = 8
-        n = self.input_np2.size
-        self.expected3 = (
-            self.padding_value * np.ones((n, n))
-            + np.diag(self.input_np2, self.offset)
-            - np.diag(self.padding_value * np.ones(n))
+    @classmethod
+    def setUpClass(cls):
+        # The inputs and expected results are shared by all test methods,
+        # build them once and make them read-only so no test can mutate them.
+        # The large cases cost ~40MB and are only run where CUDA is
+        # available, or when PADDLE_TEST_LARGE=1 is set.
+        cls.large_enabled = (
+            core.is_compiled_with_cuda()
+            or os.environ.get('PADDLE_TEST_LARGE') == '1'
         )
-
-        self.input_np3 = np.random.randint(-10, 10, size=(100)).astype(np.int64)
-        self.padding_value = 8.0
-        n = self.input_np3.size
-        self.expected4 = (
-            self.padding_value * np.ones((n, n))
-            + np.diag(self.input_np3, self.offset)
-            - np.diag(self.padding_value * np.ones(n))
+        cls._setup_small()
+        if cls.large_enabled:
+            cls._setup_large()
+
+        for value in vars(cls).values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+
+        cls.build_static_program()
+
+    @classmethod
+    def _setup_small(cls):
+        cls.input_np = _RNG.random((10, 10), dtype=np.float32)
+        cls.expected0 = np.diag(cls.input_np)
+        cls.expected1 = np.diag(cls.input_np, k=1)
+        cls.expected2 = np.diag(cls.input_np, k=-1)
+
+        cls.input_np2 = _RNG.random(100)
+        cls.offset = 0
+        cls.padding_value = 8
+        cls.expected3 = _diag_with_padding(
+            cls.input_np2, cls.offset, cls.padding_value
         )
 
-        self.padding_value = -8
-        self.expected5 = (
-            self.padding_value * np.ones((n, n))
-            + np.diag(self.input_np3, self.offset)
-            - np.diag(self.padding_value * np.ones(n))
+        cls.input_np3 = _RNG.integers(-10, 10, size=(100), dtype=np.int64)
+        cls.padding_value = 8.0
+        cls.expected4 = _diag_with_padding(
+            cls.input_np3, cls.offset, cls.padding_value
         )
 
-        self.input_np4 = np.random.random(size=(2000, 2000)).astype(np.float32)
-        self.expected6 = np.diag(self.input_np4)
-        self.expected7 = np.diag(self.input_np4, k=1)
-        self.expected8 = np.diag(self.input_np4, k=-1)
-
-        self.input_np5 = np.random.random(size=(2000)).astype(np.float32)
-        self.expected9 = np.diag(self.input_np5)
-        self.expected10 = np.diag(self.input_np5, k=1)
-        self.expected11 = np.diag(self.input_np5, k=-1)
+        cls.padding_value = -8
+        cls.expected5 = _diag_with_padding(
+            cls.input_np3, cls.offset, cls.padding_value
+        )
 
-        self.input_np6 = np.random.random(size=(2000, 1500)).astype(np.float32)
-        self.expected12 = np.diag(self.input_np6, k=-1)
+        cls.feed = {
+            'input': cls.input_np,
+            'input2': cls.input_np2,
+            'input3': cls.input_np3,
+        }
+        cls.expected_list = [
+            cls.expected0,
+            cls.expected1,
+            cls.expected2,
+            cls.expected3,
+            cls.expected4,
+            cls.expected5,
+        ]
+
+    @classmethod
+    def _setup_large(cls):
+        cls.input_np4 = _RNG.random((2000, 2000), dtype=np.float32)
+        # Strided views of the diagonals, np.diag would copy them
+        flat = cls.input_np4.ravel()
+        cls.expected6 = flat[::2001]
+        cls.expected7 = flat[1:-2000:2001]
+        cls.expected8 = flat[2000::2001]
+
+        cls.input_np5 = _RNG.random(2000, dtype=np.float32)
+        cls.expected9 = np.diag(cls.input_np5)
+        cls.expected10 = np.diag(cls.input_np5, k=1)
+        cls.expected11 = np.diag(cls.input_np5, k=-1)
+
+        cls.input_np6 = _RNG.random((2000, 1500), dtype=np.float32)
+        cls.expected12 = np.diag(cls.input_np6, k=-1)
+
+        cls.feed.update(
+            {
+                'input4': cls.input_np4,
+                'input5': cls.input_np5,
+                'input6': cls.input_np6,
+            }
+        )
+        cls.expected_list += [
+            cls.expected6,
+            cls.expected7,
+            cls.expected8,
+            cls.expected9,
+            cls.expected10,
+            cls.expected11,
+            cls.expected12,
+        ]
 
     def run_imperative(self):
-        x = paddle.to_tensor(self.input_np)
-        y = paddle.diag(x)
-        np.testing.assert_allclose(y.numpy(), self.expected0, rtol=1e-05)
-
-        y = paddle.diag(x, offset=1)
-        np.testing.assert_allclose(y.numpy(), self.expected1, rtol=1e-05)
-
-        y = paddle.diag(x, offset=-1)
-        np.testing.assert_allclose(y.numpy(), self.expected2, rtol=1e-05)
-
-        x = paddle.to_tensor(self.input_np2)
-        y = paddle.diag(x, padding_value=8)
-        np.testing.assert_allclose(y.numpy(), self.expected3, rtol=1e-05)
-
-        x = paddle.to_tensor(self.input_np3)
-        y = paddle.diag(x, padding_value=8.0)
-        np.testing.assert_allclose(y.numpy(), self.expected4, rtol=1e-05)
-
-        y = paddle.diag(x, padding_value=-8)
-        np.testing.assert_allclose(y.numpy(), self.expected5, rtol=1e-05)
-
-        x = paddle.to_tensor(self.input_np4)
-        y = paddle.diag(x)
-        np.testing.assert_allclose(y.numpy(), self.expected6, rtol=1e-05)
-
-        y = paddle.diag(x, offset=1)
-        np.testing.assert_allclose(y.numpy(), self.expected7, rtol=1e-05)
-
-        y = paddle.diag(x, offset=-1)
-        np.testing.assert_allclose(y.numpy(), self.expected8, rtol=1e-05)
-
-        x = paddle.to_tensor(self.input_np5)
-        y = paddle.diag(x)
-        np.testing.assert_allclose(y.numpy(), self.expected9, rtol=1e-05)
-
-        y = paddle.diag(x, offset=1)
-        np.testing.assert_allclose(y.numpy(), self.expected10, rtol=1e-05)
-
-        y = paddle.diag(x, offset=-1)
-        np.testing.assert_allclose(y.numpy(), self.expected11, rtol=1e-05)
-
-        x = paddle.to_tensor(self.input_np6)
-        y = paddle.diag(x, offset=-1)
-        np.testing.assert_allclose(y.numpy(), self.expected12, rtol=1e-05)
+        inputs = [paddle.to_tensor(v) for v in self.feed.values()]
+        results = self.diag_results(*inputs)
+        for y, e in zip(results, self.expected_list):
+            self.assertEqual(y.shape, list(e.shape))
+        # Copy all results back to the host at once instead of one by one
+        res = self.concat_results(results).numpy()
+        self.check_results(res)
+
+    @classmethod
+    def diag_results(cls, x, x2, x3, x4=None, x5=None, x6=None):
+        results = [
+            paddle.diag(x),
+            paddle.diag(x, offset=1),
+            paddle.diag(x, offset=-1),
+            paddle.diag(x2, padding_value=8),
+            paddle.diag(x3, padding_value=8.0),
+            paddle.diag(x3, padding_value=-8),
+        ]
+        if cls.large_enabled:
+            results += [
+                paddle.diag(x4),
+                paddle.diag(x4, offset=1),
+                paddle.diag(x4, offset=-1),
+                paddle.diag(x5),
+                paddle.diag(x5, offset=1),
+                paddle.diag(x5, offset=-1),
+                paddle.diag(x6, offset=-1),
+            ]
+        return results
+
+    @staticmethod
+    def concat_results(results):
+        # All results flattened into one tensor, in expected_list order
+        return paddle.concat(
+            [paddle.flatten(paddle.cast(r, 'float64')) for r in results]
+        )
 
-    def run_static(self, use_gpu=False):
+    @classmethod
+    def build_static_program(cls):
+        paddle.enable_static()
         mp, sp = static.Program(), static.Program()
         with static.program_guard(mp, sp):
-            x = paddle.static.data(
-                name='input', shape=[10, 10], dtype='float32'
-            )
-            x2 = paddle.static.data(name='input2', shape=[100], dtype='float64')
-            x3 = paddle.static.data(name='input3', shape=[100], dtype='int64')
-            x4 = paddle.static.data(
-                name='input4', shape=[2000, 2000], dtype='float32'
-            )
-            x5 = paddle.static.data(
-                name='input5', shape=[2000], dtype='float32'
-            )
-            x6 = paddle.static.data(
-                name='input6', shape=[2000, 1500], dtype='float32'
-            )
-            result0 = paddle.diag(x)
-            result1 = paddle.diag(x, offset=1)
-            result2 = paddle.diag(x, offset=-1)
-            result4 = paddle.diag(x2, padding_value=8)
-            result5 = paddle.diag(x3, padding_value=8.0)
-            result6 = paddle.diag(x3, padding_value=-8)
-            result7 = paddle.diag(x4)
-            result8 = paddle.diag(x4, offset=1)
-            result9 = paddle.diag(x4, offset=-1)
-            result10 = paddle.diag(x5)
-            result11 = paddle.diag(x5, offset=1)
-            result12 = paddle.diag(x5, offset=-1)
-            result13 = paddle.diag(x6, offset=-1)
+            inputs = [
+                paddle.static.data(
+                    name='input', shape=[10, 10], dtype='float32'
+                ),
+                paddle.static.data(name='input2', shape=[100], dtype='float64'),
+                paddle.static.data(name='input3', shape=[100], dtype='int64'),
+            ]
+            if cls.large_enabled:
+                inputs += [
+                    paddle.static.data(
+                        name='input4', shape=[2000, 2000], dtype='float32'
+                    ),
+                    paddle.static.data(
+                        name='input5', shape=[2000], dtype='float32'
+                    ),
+                    paddle.static.data(
+                        name='input6', shape=[2000, 1500], dtype='float32'
+                    ),
+                ]
+            # Fetch all results as one tensor, so only a single copy back
+            # to the host is needed.
+            results = cls.diag_results(*inputs)
+            fetch = cls.concat_results(results)
+        # Shapes are known at build time, so checking them needs no extra
+        # fetch from the device.
+        shapes = [list(r.shape) for r in results]
+        cls.static_program = (mp, sp, fetch, shapes)
 
+    def run_static(self, use_gpu=False):
+        mp, sp, fetch, shapes = self.static_program
         place = base.CUDAPlace(0) if use_gpu else base.CPUPlace()
         exe = static.Executor(place)
         exe.run(sp)
-        [
-            res0,
-            res1,
-            res2,
-            res4,
-            res5,
-            res6,
-            res7,
-            res8,
-            res9,
-            res10,
-            res11,
-            res12,
-            res13,
-        ] = exe.run(
+        (res,) = exe.run(
             mp,
-            feed={
-                "input": self.input_np,
-                "input2": self.input_np2,
-                'input3': self.input_np3,
-                'input4': self.input_np4,
-                'input5': self.input_np5,
-                'input6': self.input_np6,
-            },
-            fetch_list=[
-                result0,
-                result1,
-                result2,
-                result4,
-                result5,
-                result6,
-                result7,
-                result8,
-                result9,
-                result10,
-                result11,
-                result12,
-                result13,
-            ],
+            feed=self.feed,
+            fetch_list=[fetch],
         )
 
-        np.testing.assert_allclose(res0, self.expected0, rtol=1e-05)
-        np.testing.assert_allclose(res1, self.expected1, rtol=1e-05)
-        np.testing.assert_allclose(res2, self.expected2, rtol=1e-05)
-        np.testing.assert_allclose(res4, self.expected3, rtol=1e-05)
-        np.testing.assert_allclose(res5, self.expected4, rtol=1e-05)
-        np.testing.assert_allclose(res6, self.expected5, rtol=1e-05)
-        np.testing.assert_allclose(res7, self.expected6, rtol=1e-05)
-        np.testing.assert_allclose(res8, self.expected7, rtol=1e-05)
-        np.testing.assert_allclose(res9, self.expected8, rtol=1e-05)
-        np.testing.assert_allclose(res10, self.expected9, rtol=1e-05)
-        np.testing.assert_allclose(res11, self.expected10, rtol=1e-05)
-        np.testing.assert_allclose(res12, self.expected11, rtol=1e-05)
-        np.testing.assert_allclose(res13, self.expected12, rtol=1e-05)
+        self.check_results(res, shapes)
+
+    def check_results(self, res, shapes=None):
+        if shapes is not None:
+            self.assertEqual(
+                shapes, [list(e.shape) for e in self.expected_list]
+            )
+        sections = np.cumsum([e.size for e in self.expected_list])[:-1]
+        for r, e in zip(np.split(res, sections), self.expected_list):
+            np.testing.assert_allclose(r.reshape(e.shape), e, rtol=1e-05)
 
     def test_cpu(self):
         paddle.disable_static(place=paddle.base.CPUPlace())
@@ -343,7 +362,7 @@ class TestDiagV2BF16OP(OpTest):
         self.prim_op_type = "comp"
         self.public_python_api = paddle.diag
         self.dtype = np.uint16
-        x = np.random.rand(10, 10).astype(np.float32)
+        x = _RNG.random((10, 10), dtype=np.float32)
         offset = 0
         padding_value = 0.0
         out = np.diag(x, offset)
@@ -378,8 +397,8 @@ class TestDiagV2Complex64OP(TestDiagV2Op):
 
     def init_input_output(self):
         self.x = (
-            np.random.randint(-10, 10, size=(10, 10))
-            + 1j * np.random.randint(-10, 10, size=(10, 10))
+            _RNG.integers(-10, 10, size=(10, 10))
+            + 1j * _RNG.integers(-10, 10, size=(10, 10))
         ).astype(self.dtype)
         self.out = np.diag(self.x, self.offset)
 
@@ -394,8 +413,8 @@ class TestDiagV2Complex128OP(TestDiagV2Op):
 
     def init_config(self):
         self.x = (
-            np.random.randint(-10, 10, size=(10, 10))
-            + 1j * np.random.randint(-10, 10, size=(10, 10))
+            _RNG.integers(-10, 10, size=(10, 10))
+            + 1j * _RNG.integers(-10, 10, size=(10, 10))
         ).astype(self.dtype)
         self.out = np.diag(self.x, self.offset)
 
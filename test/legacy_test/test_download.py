@@ -12,10 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import os
+import tempfile
 import unittest
+from unittest import mock
 
-from paddle.utils.download import get_path_from_url, get_weights_path_from_url
+import httpx
+
+from paddle.utils.download import (
+    DOWNLOAD_RETRY_LIMIT,
+    ETAG_SUFFIX,
+    _download,
+    get_path_from_url,
+    get_weights_path_from_url,
+)
 
 
 class TestDownload(unittest.TestCase):
@@ -141,5 +152,143 @@ class TestDownload(unittest.TestCase):
                 )
 
 
+class TestDownloadResume(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.fullname = os.path.join(self.temp_dir.name, 'model.pdparams')
+        self.tmp_fullname = self.fullname + '_tmp'
+        self.content = bytes(range(256)) * 16
+        self.etag = '"v1"'
+        self.requests = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def handler(self, request):
+        range_ = request.headers.get('Range')
+        self.requests.append(range_)
+        size = len(self.content)
+        if range_ and request.headers.get('If-Range') == self.etag:
+            start = int(range_[len('bytes=') : -1])
+            if start >= size:
+                return httpx.Response(416)
+            return httpx.Response(
+                206,
+                headers={
+                    'ETag': self.etag,
+                    'Content-Range': f'bytes {start}-{size - 1}/{size}',
+                },
+                content=self.content[start:],
+            )
+        return httpx.Response(
+            200, headers={'ETag': self.etag}, content=self.content
+        )
+
+    def write_partial(self, data, etag):
+        with open(self.tmp_fullname, 'wb') as f:
+            f.write(data)
+        with open(self.tmp_fullname + ETAG_SUFFIX, 'w') as f:
+            f.write(etag)
+
+    def download(self, md5sum=None):
+        client = httpx.Client(transport=httpx.MockTransport(self.handler))
+        with mock.patch('httpx.stream', client.stream):
+            return _download(
+                'https://example.com/model',
+                self.temp_dir.name,
+                md5sum,
+                fname='model.pdparams',
+                resume=True,
+            )
+
+    def check_downloaded(self):
+        with open(self.fullname, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(os.path.exists(self.tmp_fullname))
+        self.assertFalse(os.path.exists(self.tmp_fullname + ETAG_SUFFIX))
+
+    def test_resume_206(self):
+        self.write_partial(self.content[:1000], self.etag)
+        self.assertEqual(self.download(), self.fullname)
+        self.check_downloaded()
+        self.assertEqual(self.requests, ['bytes=1000-'])
+
+    def test_resume_200_restart(self):
+        # The file has changed on the server, so it is sent again in full
+        self.write_partial(b'x' * 1000, '"v0"')
+        self.assertEqual(self.download(), self.fullname)
+        self.check_downloaded()
+        self.assertEqual(self.requests, ['bytes=1000-'])
+
+    def test_resume_416(self):
+        # The previous download was interrupted right before the rename
+        self.write_partial(self.content, self.etag)
+        self.assertEqual(self.download(), self.fullname)
+        self.check_downloaded()
+        self.assertEqual(self.requests, [f'bytes={len(self.content)}-'])
+
+    def test_resume_md5_retry(self):
+        # A corrupted partial file fails the md5 check, the retry starts over
+        self.write_partial(b'x' * 1000, self.etag)
+        md5sum = hashlib.md5(self.content).hexdigest()
+        self.assertEqual(self.download(md5sum), self.fullname)
+        self.check_downloaded()
+        self.assertEqual(self.requests, ['bytes=1000-', None])
+
+        os.remove(self.fullname)
+        self.requests = []
+        with self.assertRaises(RuntimeError):
+            self.download('0' * 32)
+        self.assertEqual(self.requests, [None] * DOWNLOAD_RETRY_LIMIT)
+
+
+class TestDownloadConditional(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.fullname = os.path.join(self.temp_dir.name, 'model')
+        self.etag = '"v1"'
+        self.requests = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def handler(self, request):
+        self.requests.append(dict(request.headers))
+        if request.headers.get('If-None-Match') == self.etag:
+            return httpx.Response(304, headers={'ETag': self.etag})
+        return httpx.Response(200, headers={'ETag': self.etag}, content=b'1')
+
+    def download(self, **kwargs):
+        client = httpx.Client(transport=httpx.MockTransport(self.handler))
+        with mock.patch('httpx.stream', client.stream):
+            return _download(
+                'https://example.com/model', self.temp_dir.name, **kwargs
+            )
+
+    def test_headers(self):
+        # Plain headers are only passed through
+        path = self.download(headers={'Authorization': 'token'})
+        self.assertEqual(path, self.fullname)
+        self.assertTrue(os.path.exists(self.fullname))
+        self.assertFalse(os.path.exists(self.fullname + ETAG_SUFFIX))
+        self.assertEqual(self.requests[0]['authorization'], 'token')
+        self.assertNotIn('if-none-match', self.requests[0])
+
+    def test_conditional(self):
+        # 200: download and record the ETag
+        self.download(conditional=True)
+        self.assertTrue(os.path.exists(self.fullname))
+        with open(self.fullname + ETAG_SUFFIX) as f:
+            self.assertEqual(f.read(), self.etag)
+
+        # 304: nothing is downloaded
+        os.remove(self.fullname)
+        self.download(conditional=True, etag=self.etag)
+        self.assertFalse(os.path.exists(self.fullname))
+        with open(self.fullname + ETAG_SUFFIX) as f:
+            self.assertEqual(f.read(), self.etag)
+        self.assertEqual(self.requests[1]['if-none-match'], self.etag)
+
+
 if __name__ == '__main__':
     unittest.main()
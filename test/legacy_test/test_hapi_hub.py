@@ -12,13 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
 import os
+import pickle
+import tempfile
 import unittest
+import zipfile
+from unittest import mock
 
+import httpx
 import numpy as np
 
 import paddle
 from paddle.hapi import hub
+from paddle.utils.download import ETAG_SUFFIX
 
 
 class TestHub(unittest.TestCase):
@@ -155,5 +162,224 @@ class TestHub(unittest.TestCase):
             )
 
 
+class TestHubArchiveUrl(unittest.TestCase):
+    def test_build_archive_url(self):
+        owner, name, branch, _ = hub._build_archive_url('a/b', 'github')
+        self.assertEqual((owner, name, branch), ('a', 'b', 'main'))
+        owner, name, branch, _ = hub._build_archive_url('a/b:dev/x', 'gitee')
+        self.assertEqual((owner, name, branch), ('a', 'b', 'dev/x'))
+
+    def test_build_archive_url_invalid(self):
+        for repo in ['a', 'a/', '/b', 'a/b/c', 'a/b:x:y']:
+            with self.assertRaises(ValueError):
+                hub._build_archive_url(repo, 'github')
+
+
+class TestHubExtractRepo(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.archive = os.path.join(self.temp_dir.name, 'main.zip')
+        self.repo_dir = os.path.join(self.temp_dir.name, 'repo')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_extract_repo(self):
+        large = os.urandom((1 << 20) + 123)
+        with zipfile.ZipFile(self.archive, 'w') as f:
+            f.writestr('demo-main/', '')
+            f.writestr('demo-main/hubconf.py', 'def MM():\n    pass\n')
+            f.writestr('demo-main/empty_dir/', '')
+            f.writestr('demo-main/empty_file', '')
+            f.writestr('demo-main/weights/large.bin', large)
+            for i in range(64):
+                f.writestr(f'demo-main/small/{i % 4}/{i}.txt', str(i) * i)
+
+        hub._extract_repo(self.archive, self.repo_dir)
+
+        self.assertFalse(
+            os.path.exists(os.path.join(self.repo_dir, 'demo-main'))
+        )
+        with open(os.path.join(self.repo_dir, 'hubconf.py')) as f:
+            self.assertEqual(f.read(), 'def MM():\n    pass\n')
+        self.assertTrue(os.path.isdir(os.path.join(self.repo_dir, 'empty_dir')))
+        self.assertEqual(
+            os.path.getsize(os.path.join(self.repo_dir, 'empty_file')), 0
+        )
+        with open(
+            os.path.join(self.repo_dir, 'weights', 'large.bin'), 'rb'
+        ) as f:
+            self.assertEqual(f.read(), large)
+        for i in range(64):
+            path = os.path.join(self.repo_dir, 'small', str(i % 4), f'{i}.txt')
+            with open(path) as f:
+                self.assertEqual(f.read(), str(i) * i)
+
+    def test_extract_repo_outside(self):
+        with zipfile.ZipFile(self.archive, 'w') as f:
+            f.writestr('demo-main/', '')
+            f.writestr('demo-main/../../evil.py', 'pass\n')
+
+        with self.assertRaises(RuntimeError):
+            hub._extract_repo(self.archive, self.repo_dir)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.temp_dir.name, 'evil.py'))
+        )
+
+
+class TestHubLocalRepo(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.repo_dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_hubconf(self, content):
+        hubconf = os.path.join(self.repo_dir, 'hubconf.py')
+        with open(hubconf, 'w') as f:
+            f.write(content)
+        return hubconf
+
+    def test_reload_modified_hubconf(self):
+        hubconf = self.write_hubconf('def model_a():\n    pass\n')
+        st = os.stat(hubconf)
+        self.assertEqual(hub.list(self.repo_dir, source='local'), ['model_a'])
+        self.assertEqual(hub.list(self.repo_dir, source='local'), ['model_a'])
+
+        self.write_hubconf('def model_b():\n    pass\n\n\n# edited\n')
+        # Edited within the same mtime tick, e.g. on a coarse filesystem
+        os.utime(hubconf, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(hub.list(self.repo_dir, source='local'), ['model_b'])
+
+    def test_hubconf_with_dataclass(self):
+        self.write_hubconf(
+            '''from __future__ import annotations
+
+import dataclasses
+
+
+@dataclasses.dataclass
+class Config:
+    channels: int = 8
+
+
+def model(channels: int = 8):
+    """Model with a dataclass config"""
+    return Config(channels)
+'''
+        )
+        self.assertEqual(
+            hub.help(self.repo_dir, model='model', source='local'),
+            'Model with a dataclass config',
+        )
+        config = hub.load(
+            self.repo_dir, model='model', source='local', channels=4
+        )
+        self.assertEqual(config.channels, 4)
+        self.assertEqual(pickle.loads(pickle.dumps(config)), config)
+
+
+class TestHubCheckFresh(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.origin_hub_dir = hub.HUB_DIR
+        hub.HUB_DIR = self.temp_dir.name
+        self.etag = '"v1"'
+        self.requests = []
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as f:
+            f.writestr('paddlehub_demo-main/', '')
+            f.writestr(
+                'paddlehub_demo-main/hubconf.py', 'def MM():\n    pass\n'
+            )
+        self.archive = archive.getvalue()
+
+    def tearDown(self):
+        hub.HUB_DIR = self.origin_hub_dir
+        self.temp_dir.cleanup()
+
+    def handler(self, request):
+        if_none_match = request.headers.get('If-None-Match')
+        self.requests.append(if_none_match)
+        if if_none_match == self.etag:
+            return httpx.Response(304, headers={'ETag': self.etag})
+        return httpx.Response(
+            200, headers={'ETag': self.etag}, content=self.archive
+        )
+
+    def get_repo(self):
+        return hub._get_cache_or_reload(
+            'lyuwenyu/paddlehub_demo:main', False, False, check_fresh=True
+        )
+
+    def test_check_fresh(self):
+        client = httpx.Client(transport=httpx.MockTransport(self.handler))
+        with mock.patch('httpx.stream', client.stream):
+            # 200: extract the archive and record its ETag, the ETag file
+            # of the archive itself is removed once it has been read
+            archive_etag = os.path.join(
+                self.temp_dir.name, 'main.zip' + ETAG_SUFFIX
+            )
+            repo_dir = self.get_repo()
+            self.assertTrue(
+                os.path.isfile(os.path.join(repo_dir, 'hubconf.py'))
+            )
+            with open(repo_dir + ETAG_SUFFIX) as f:
+                self.assertEqual(f.read(), '"v1"')
+            self.assertFalse(os.path.exists(archive_etag))
+
+            # 304: reuse the cached repo as is
+            marker = os.path.join(repo_dir, 'marker')
+            open(marker, 'w').close()
+            self.assertEqual(self.get_repo(), repo_dir)
+            self.assertTrue(os.path.exists(marker))
+            self.assertFalse(os.path.exists(archive_etag))
+
+            # 200 with a new ETag: extract again
+            self.etag = '"v2"'
+            self.assertEqual(self.get_repo(), repo_dir)
+            self.assertFalse(os.path.exists(marker))
+            with open(repo_dir + ETAG_SUFFIX) as f:
+                self.assertEqual(f.read(), '"v2"')
+
+        self.assertEqual(self.requests, [None, '"v1"', '"v1"'])
+
+    def test_check_fresh_offline(self):
+        client = httpx.Client(transport=httpx.MockTransport(self.handler))
+        with mock.patch('httpx.stream', client.stream):
+            repo_dir = self.get_repo()
+
+        def offline(request):
+            raise httpx.ConnectError('offline')
+
+        client = httpx.Client(transport=httpx.MockTransport(offline))
+        with mock.patch('httpx.stream', client.stream), mock.patch(
+            'time.sleep'
+        ):
+            with self.assertWarns(UserWarning):
+                self.assertEqual(self.get_repo(), repo_dir)
+        self.assertTrue(os.path.isfile(os.path.join(repo_dir, 'hubconf.py')))
+
+    def test_extract_failure(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as f:
+            f.writestr('paddlehub_demo-main/hubconf.py', '')
+            f.writestr('paddlehub_demo-main/big.bin', b'a' * (3 << 20))
+        # Corrupt the data of big.bin so that its CRC check fails
+        self.archive = archive.getvalue().replace(b'a' * 16, b'b' * 16, 1)
+
+        client = httpx.Client(transport=httpx.MockTransport(self.handler))
+        with mock.patch('httpx.stream', client.stream):
+            for _ in range(2):
+                with self.assertRaises(zipfile.BadZipFile):
+                    hub._get_cache_or_reload(
+                        'lyuwenyu/paddlehub_demo:main', False, False
+                    )
+                # Neither the archive nor a half extracted repo is kept
+                self.assertEqual(os.listdir(self.temp_dir.name), [])
+
+
 if __name__ == '__main__':
     unittest.main()